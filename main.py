@@ -1,4 +1,7 @@
 import argparse
+import functools
+import io
+import itertools
 import logging
 import os
 import re
@@ -6,13 +9,17 @@ import subprocess as sp
 import sys
 from pathlib import Path
 from shutil import which
-from typing import Optional
+from typing import Iterable, Iterator, NamedTuple, Optional
 
-from iterfzf import iterfzf
+GIT_BIN = "git"
+HEAD_BRANCH_RE = re.compile(r"^\s*HEAD\s+branch:\s*(\S+)")
 
-logging.basicConfig(
-    level=logging.DEBUG, format="{levelname}: {message}", style="{", stream=sys.stderr
-)
+
+class Worktree(NamedTuple):
+    path: Path
+    is_bare: bool
+    branch: str
+    notes: tuple[str, ...] = ()
 
 
 def path_is_truthy(path: Path) -> bool:
@@ -20,14 +27,22 @@ def path_is_truthy(path: Path) -> bool:
 
 
 def git(*cmds: str, cwd: Optional[Path] = None) -> sp.CompletedProcess:
-    if not cwd:
-        cwd = Path.cwd()
-    git_command = list(filter(None, [which("git"), *cmds]))
+    git_command = [GIT_BIN, *cmds]
     proc = sp.run(git_command, capture_output=True, cwd=cwd, text=True, check=True)
     return proc
 
 
 def is_inside_git_repo() -> bool:
+    # Look for a .git entry or a bare repository layout before paying for a git exec
+    # Git may still reject what the walk accepts; let it decide when these are set
+    git_env = ("GIT_DIR", "GIT_WORK_TREE", "GIT_CEILING_DIRECTORIES")
+    if not any(name in os.environ for name in git_env):
+        cwd = Path.cwd()
+        for directory in (cwd, *cwd.parents):
+            if (directory / ".git").exists() or (
+                (directory / "HEAD").is_file() and (directory / "objects").is_dir()
+            ):
+                return True
     try:
         git("rev-parse")
     except sp.CalledProcessError:
@@ -35,27 +50,86 @@ def is_inside_git_repo() -> bool:
     return True
 
 
-def get_default_branch_name() -> str:
+@functools.lru_cache(maxsize=1)
+def get_default_branch_name(bare_path: Path) -> str:
+    # Resolve the branch locally first; `remote show` needs a network round-trip.
+    # `clone --bare` creates no origin/HEAD, but its own HEAD is the remote default,
+    # which only means anything when an origin remote is configured.
     try:
-        result = git("remote", "show", "origin")
+        result = git(
+            "symbolic-ref", "--short", "refs/remotes/origin/HEAD", cwd=bare_path
+        )
+        return result.stdout.strip().removeprefix("origin/")
+    except sp.CalledProcessError:
+        pass
+    try:
+        git("config", "--get", "remote.origin.url", cwd=bare_path)
     except sp.CalledProcessError:
         return ""
-    origin_regex = re.compile(r"^\s*HEAD\s*branch:\s*(.*)$")
-    for line in result.stdout.split("\n"):
-        match = re.match(origin_regex, line)
+    try:
+        return git("symbolic-ref", "--short", "HEAD", cwd=bare_path).stdout.strip()
+    except sp.CalledProcessError:
+        pass
+    try:
+        result = git("remote", "show", "origin", cwd=bare_path)
+    except sp.CalledProcessError:
+        return ""
+    for line in result.stdout.splitlines():
+        match = HEAD_BRANCH_RE.match(line)
         if match:
             return match.group(1)
     return ""
 
 
-def list_worktrees() -> str:
-    return git("worktree", "list").stdout
+def parse_worktree(record: str) -> Worktree:
+    path, is_bare, branch = "", False, ""
+    notes: list[str] = []
+    for field in record.split("\0"):
+        key, _, value = field.partition(" ")
+        if key == "worktree":
+            path = value
+        elif key == "bare":
+            is_bare = True
+        elif key == "branch":
+            branch = value.removeprefix("refs/heads/")
+        elif key in ("locked", "prunable"):
+            notes.append(key)
+    return Worktree(Path(path), is_bare, branch, tuple(notes))
+
+
+def iter_worktrees() -> Iterator[Worktree]:
+    # Porcelain -z output: NUL-terminated fields, records separated by an empty field.
+    # Records are yielded as soon as git writes them instead of after it exits.
+    command = [GIT_BIN, "worktree", "list", "--porcelain", "-z"]
+    with sp.Popen(command, stdout=sp.PIPE) as proc:
+        assert proc.stdout is not None
+        buffer = b""
+        while chunk := os.read(proc.stdout.fileno(), 65536):
+            *records, buffer = (buffer + chunk).split(b"\0\0")
+            for record in records:
+                yield parse_worktree(os.fsdecode(record))
+        if buffer:
+            yield parse_worktree(os.fsdecode(buffer.rstrip(b"\0")))
+    if proc.returncode:
+        raise sp.CalledProcessError(proc.returncode, command)
+
+
+@functools.lru_cache(maxsize=1)
+def list_worktrees() -> tuple[Worktree, ...]:
+    return tuple(iter_worktrees())
+
+
+def format_worktree(worktree: Worktree) -> str:
+    if worktree.is_bare:
+        return f"{worktree.path}  (bare)"
+    ref = f"[{worktree.branch}]" if worktree.branch else "(detached HEAD)"
+    return " ".join([f"{worktree.path}  {ref}", *worktree.notes])
 
 
 def get_bare_worktree_path() -> Path:
-    for worktree in list_worktrees().splitlines():
-        if "(bare)" in worktree:
-            return Path(worktree.split()[0])
+    for worktree in list_worktrees():
+        if worktree.is_bare:
+            return worktree.path
     raise ValueError("No bare worktree found")
 
 
@@ -64,79 +138,103 @@ def add_worktree(args: argparse.Namespace) -> Path:
     worktree_path = bare_path / args.path[0]
     try:
         git("worktree", "add", *args.path, cwd=bare_path)
-        default_branch_name = get_default_branch_name()
+        list_worktrees.cache_clear()
+        default_branch_name = get_default_branch_name(bare_path)
         if default_branch_name:
-            logging.info("Fetching changes")
-            git("fetch", "--all", cwd=worktree_path)
-            logging.info(f"Merging with {default_branch_name}")
-            git("merge", default_branch_name, cwd=worktree_path)
+            logging.info("Pulling %s from origin", default_branch_name)
+            git("pull", "--no-rebase", "origin", default_branch_name, cwd=worktree_path)
     except sp.CalledProcessError:
-        logging.exception(f"Failed to add {args.path[0]} worktree", exc_info=True)
+        logging.exception("Failed to add %s worktree", args.path[0])
     return worktree_path
 
 
-def select_worktree(exclude_bare: bool = True) -> Path:
-    worktrees = list_worktrees().splitlines()
-    options = [line for line in worktrees if not ("(bare)" in line and exclude_bare)]
-    if not options:
+def select_worktree(worktrees: Iterable[Worktree], exclude_bare: bool = True) -> Path:
+    from iterfzf import iterfzf
+
+    options: dict[str, Path] = {}
+
+    def iter_options() -> Iterator[str]:
+        # Fed lazily so fzf can render entries while git is still listing.
+        # Undecodable path bytes are shown as U+FFFD, as git and fzf display them.
+        for worktree in worktrees:
+            if exclude_bare and worktree.is_bare:
+                continue
+            option = os.fsencode(format_worktree(worktree)).decode(errors="replace")
+            options[option] = worktree.path
+            yield option
+
+    lines = iter_options()
+    first = next(lines, None)
+    if first is None:
         logging.error("No worktrees available.")
         return Path()
     try:
-        choice = iterfzf(options, prompt="Select worktree > ")
-        return Path(choice.split()[0])  # pyright: ignore[reportAttributeAccessIssue, reportOptionalMemberAccess]
+        choice = iterfzf(itertools.chain([first], lines), prompt="Select worktree > ")
+        return options[choice] if isinstance(choice, str) else Path()
     except KeyboardInterrupt:
         return Path()
 
 
 def remove_worktree(args: argparse.Namespace) -> Path:
     bare_path = get_bare_worktree_path()
+    force = ["--force"] if args.force else []
     if args.all:
-        os.chdir(bare_path)
-        worktrees = list_worktrees().splitlines()
-        for line in worktrees:
-            if "(bare)" in line:
+        # Removals run serially: each one scans $GIT_DIR/worktrees, which
+        # concurrent removals mutate underneath it
+        for worktree in list_worktrees():
+            if worktree.is_bare:
                 continue
-            dir_path = line.split()[0]
             try:
-                logging.info(f"Removing {dir_path}...")
-                git("worktree", "remove", dir_path, "--force" if args.force else "")
+                logging.info("Removing %s...", worktree.path)
+                git("worktree", "remove", str(worktree.path), *force, cwd=bare_path)
             except sp.CalledProcessError:
-                logging.exception(
-                    f"Failed to remove {dir_path} worktree", exc_info=True
-                )
+                logging.exception("Failed to remove %s worktree", worktree.path)
+        list_worktrees.cache_clear()
         return bare_path
     else:
-        dir_path = select_worktree()
+        dir_path = select_worktree(list_worktrees())
         cwd_path = Path.cwd()
         if path_is_truthy(dir_path):
-            logging.info(f"Removing worktree: {dir_path}")
+            logging.info("Removing worktree: %s", dir_path)
             try:
-                git(
-                    "worktree", "remove", str(dir_path), "--force" if args.force else ""
-                )
+                git("worktree", "remove", str(dir_path), *force, cwd=bare_path)
+                list_worktrees.cache_clear()
             except sp.CalledProcessError:
-                logging.exception(
-                    f"Failed to remove {dir_path} worktree", exc_info=True
-                )
+                logging.exception("Failed to remove %s worktree", dir_path)
                 return Path()
             return bare_path if dir_path.name == cwd_path.name else cwd_path
         return Path()
 
 
 def switch_worktree() -> Path:
-    dir_path = select_worktree()
+    dir_path = select_worktree(iter_worktrees())
     if path_is_truthy(dir_path):
-        logging.info(f"Changing current worktree: {dir_path.name}")
+        logging.info("Changing current worktree: %s", dir_path.name)
     return dir_path
 
 
 def cd_bare() -> Path:
     bare_path = get_bare_worktree_path()
-    logging.info(f"Changing to bare directory: {bare_path}")
+    logging.info("Changing to bare directory: %s", bare_path)
     return bare_path
 
 
 def main() -> None:
+    log_level = os.environ.get("WT_LOG", "INFO").upper()
+    level = logging.getLevelNamesMapping().get(log_level)
+    logging.basicConfig(
+        level=logging.INFO if level is None else level,
+        format="{levelname}: {message}",
+        style="{",
+        stream=sys.stderr,
+    )
+    if level is None:
+        logging.warning("Unknown WT_LOG level %r, using INFO", log_level)
+
+    if not which(GIT_BIN):
+        logging.error("git not found")
+        sys.exit(127)
+
     if not is_inside_git_repo():
         logging.error("Not a git repository")
         sys.exit(128)
@@ -164,16 +262,29 @@ def main() -> None:
 
     args = parser.parse_args()
 
+    # Printed paths may carry undecodable bytes from os.fsdecode; emit them as-is
+    if isinstance(sys.stdout, io.TextIOWrapper):
+        sys.stdout.reconfigure(errors="surrogateescape")
+
     if args.command == "list":
-        print(list_worktrees(), file=sys.stderr)
-    elif args.command == "bare":
-        print(cd_bare())
-    elif args.command == "add":
-        print(add_worktree(args))
-    elif args.command == "remove":
-        print(remove_worktree(args))
-    else:
-        print(switch_worktree())
+        # Hand the process over to git; stdout is reserved for the path wt.sh cds into
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+        os.execvp(GIT_BIN, [GIT_BIN, "worktree", "list"])
+
+    try:
+        if args.command == "bare":
+            print(cd_bare())
+        elif args.command == "add":
+            print(add_worktree(args))
+        elif args.command == "remove":
+            print(remove_worktree(args))
+        else:
+            print(switch_worktree())
+    except sp.CalledProcessError as error:
+        # e.g. git rejecting a repository is_inside_git_repo() accepted; git has
+        # already explained why on stderr
+        logging.error("%s exited with status %d", " ".join(error.cmd), error.returncode)
+        sys.exit(error.returncode)
 
 
 if __name__ == "__main__":